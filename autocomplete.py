@@ -0,0 +1,229 @@
+"""
+In-memory prefix index for search-as-you-type (/autocomplete?q= in server.py).
+
+Every song, album, artist, playlist and genre name is indexed under its whole
+name and under each later word, lowercased, so "Midnight Echo" is found by typing
+"mid" or "ech", and names that start with what was typed come first. A lookup is
+a bisect into a sorted array and a short walk forward, with no database round trip.
+
+To keep millions of names small, the sorted keys are packed into one big string
+plus an array of offsets instead of one Python string object per key (see
+_Packed). Changes made after a load go into small sorted lists next to the packed
+arrays and are merged in every COMPACT_AFTER changes.
+"""
+import heapq
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+from itertools import accumulate
+
+# Merge the changes made since the last load into the packed arrays after this many of them
+COMPACT_AFTER = 5000
+
+
+def normalize(name):
+  """Lowercases a name and collapses its whitespace."""
+  return ' '.join(name.replace('\x00', ' ').casefold().split())
+
+
+def index_keys(name):
+  """'Midnight Echo Club' -> ('midnight echo club', ['echo club', 'club'])"""
+  words = normalize(name).split(' ')
+  keys = [' '.join(words[i:]) for i in range(len(words))]
+  return keys[0], keys[1:]
+
+
+class _Packed:
+  """A read-only list of strings stored as one string plus the offset where each one starts."""
+
+  def __init__(self, strings):
+    self.blob = ''.join(strings)
+    self.offsets = array('Q', accumulate(map(len, strings), initial=0))
+
+  def __len__(self):
+    return len(self.offsets) - 1
+
+  def __getitem__(self, i):
+    return self.blob[self.offsets[i]:self.offsets[i + 1]]
+
+  def nbytes(self):
+    return sys.getsizeof(self.blob) + sys.getsizeof(self.offsets)
+
+
+class _Keys:
+  """One sorted set of (key, slot) pairs: a packed part from the last load and a small list of later additions."""
+
+  def __init__(self, pairs):
+    pairs.sort()
+    self.packed = _Packed([key for key, slot in pairs])
+    self.slots = array('I', [slot for key, slot in pairs])
+    self.recent = []  # sorted (key, slot), replaced (never changed in place) so readers can keep using the old one
+
+  def scan(self, prefix):
+    """Every (key, slot) whose key starts with prefix, in key order."""
+    return heapq.merge(self._scan_packed(prefix), self._scan_recent(self.recent, prefix))
+
+  def _scan_packed(self, prefix):
+    packed, slots = self.packed, self.slots
+    for i in range(bisect_left(packed, prefix), len(packed)):
+      key = packed[i]
+      if not key.startswith(prefix):
+        return
+      yield key, slots[i]
+
+  def _scan_recent(self, recent, prefix):
+    for i in range(bisect_left(recent, (prefix,)), len(recent)):
+      if not recent[i][0].startswith(prefix):
+        return
+      yield recent[i]
+
+  def nbytes(self):
+    return (self.packed.nbytes() + sys.getsizeof(self.slots) + sys.getsizeof(self.recent) +
+            sum(sys.getsizeof(pair) + sys.getsizeof(pair[0]) for pair in self.recent))
+
+
+class _State:
+  """
+  Everything one load produced. Items are numbered (their slot) and stored as
+  "kind\\x00id\\x00name"; a removed item's slot goes into `dead` until the next compaction.
+  """
+
+  def __init__(self, items):
+    names, words = [], []
+    for slot, (kind, item_id, name) in enumerate(items):
+      name_key, word_keys = index_keys(name)
+      names.append((name_key, slot))
+      words.extend((key, slot) for key in word_keys)
+    self.items = _Packed(['%s\x00%s\x00%s' % item for item in items])
+    self.extra = []    # items added since the load, slots len(self.items) and up
+    self.dead = set()  # slots of removed items
+    self.names = _Keys(names)
+    self.words = _Keys(words)
+    self.changes = 0
+
+  def __len__(self):
+    return len(self.items) + len(self.extra)
+
+  def item(self, slot):
+    packed = len(self.items)
+    item = self.items[slot] if slot < packed else self.extra[slot - packed]
+    return tuple(item.split('\x00', 2))
+
+  def live_items(self):
+    return [self.item(slot) for slot in range(len(self)) if slot not in self.dead]
+
+
+class PrefixIndex:
+  """
+  Names of catalog items, searchable by the start of any of their words.
+
+      index = PrefixIndex()
+      index.load(conn.execute(text("SELECT 'artist', ArtistID, Name FROM Artist")))
+      index.search('mid', 10)   # [('artist', 'a1', 'Midnight Echo'), ...]
+      index.add('artist', 'a2', 'Velvet Echo')
+      index.remove('artist', 'a2', 'Velvet Echo')
+
+  add() and remove() update the index one item at a time, so it only has to be
+  loaded in full once. Searches never wait for them.
+  """
+
+  def __init__(self):
+    self._state = _State([])
+    self._lock = threading.Lock()  # one writer at a time
+    self.loaded_at = None
+    self.compactions = 0
+
+  def __len__(self):
+    state = self._state
+    return len(state) - len(state.dead)
+
+  def load(self, rows):
+    """Replaces the whole index with (kind, id, name) rows."""
+    items = [(kind, item_id.strip(), name.strip()) for kind, item_id, name in rows]
+    state = _State(items)
+    with self._lock:
+      self._state = state
+      self.loaded_at = time.time()
+
+  def add(self, kind, item_id, name, old_name=None):
+    """Adds an item. Pass the item's previous name to rename it."""
+    item_id, name = item_id.strip(), name.strip()
+    with self._lock:
+      state = self._state
+      # A change can arrive for an item the last load already saw, so drop any existing copy first
+      self._remove(state, kind, item_id, name)
+      if old_name is not None:
+        self._remove(state, kind, item_id, old_name.strip())
+
+      slot = len(state)
+      state.extra.append('%s\x00%s\x00%s' % (kind, item_id, name))
+      name_key, word_keys = index_keys(name)
+      for keys, new in ((state.names, [name_key]), (state.words, word_keys)):
+        recent = list(keys.recent)
+        for key in new:
+          insort(recent, (key, slot))
+        keys.recent = recent
+      self._changed(state)
+
+  def remove(self, kind, item_id, name):
+    with self._lock:
+      state = self._state
+      self._remove(state, kind, item_id.strip(), name.strip())
+      self._changed(state)
+
+  def _remove(self, state, kind, item_id, name):
+    """Marks the item dead. It's found through its name, so the name it was indexed under is needed."""
+    name_key, _ = index_keys(name)
+    for key, slot in state.names.scan(name_key):
+      if key != name_key:
+        break
+      if slot not in state.dead and state.item(slot)[:2] == (kind, item_id):
+        state.dead.add(slot)
+
+  def _changed(self, state):
+    state.changes += 1
+    if state.changes >= COMPACT_AFTER:
+      self._state = _State(state.live_items())
+      self.compactions += 1
+
+  def search(self, prefix, limit=10):
+    """
+    Up to `limit` (kind, id, name) items with a word starting with `prefix`: names
+    that start with it first, then names with a later word that does, each group in
+    alphabetical order.
+    """
+    prefix = normalize(prefix)
+    if not prefix:
+      return []
+    state = self._state
+    found, seen = [], set()
+    for keys in (state.names, state.words):
+      for key, slot in keys.scan(prefix):
+        if len(found) >= limit:
+          return found
+        if slot in state.dead or slot in seen:
+          continue
+        item = state.item(slot)
+        if item not in found:
+          seen.add(slot)
+          found.append(item)
+    return found
+
+  def stats(self):
+    """Item and key counts plus the memory the index holds."""
+    state = self._state
+    items_bytes = (state.items.nbytes() + sys.getsizeof(state.extra) + sum(sys.getsizeof(item) for item in state.extra) +
+                   sys.getsizeof(state.dead))
+    keys_bytes = state.names.nbytes() + state.words.nbytes()
+    return {
+      'items': len(self),
+      'keys': len(state.names.packed) + len(state.names.recent) + len(state.words.packed) + len(state.words.recent),
+      'changes_since_compaction': state.changes,
+      'compactions': self.compactions,
+      'items_bytes': items_bytes,
+      'keys_bytes': keys_bytes,
+      'total_bytes': items_bytes + keys_bytes,
+      'loaded_at': self.loaded_at,
+    }
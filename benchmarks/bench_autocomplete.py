@@ -0,0 +1,75 @@
+"""
+Measures the autocomplete prefix index (autocomplete.py) on a synthetic catalog:
+how long a load takes, how much memory it holds, and the per-keystroke latency of
+typing out names one character at a time.
+
+Nothing touches the database.
+
+    python3 benchmarks/bench_autocomplete.py --names 1000000
+"""
+import os
+import random
+import sys
+import time
+
+import click
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from autocomplete import PrefixIndex
+
+WORDS = ['midnight', 'velvet', 'echo', 'neon', 'river', 'golden', 'static', 'paper', 'lunar', 'wild',
+         'silver', 'ghost', 'harbor', 'crystal', 'thunder', 'honey', 'violet', 'desert', 'arcade', 'summer']
+KINDS = ['song'] * 6 + ['album', 'artist', 'playlist', 'genre']
+
+
+def percentile(samples, pct):
+  samples = sorted(samples)
+  index = min(len(samples) - 1, int(round(pct / 100 * (len(samples) - 1))))
+  return samples[index]
+
+
+def synthetic_names(count, rng):
+  for i in range(count):
+    words = [rng.choice(WORDS).capitalize() for w in range(rng.randint(1, 3))]
+    yield rng.choice(KINDS), 'x%d' % i, ' '.join(words) + ' %d' % (i % 997)
+
+
+@click.command()
+@click.option('--names', default=1000000, help='Synthetic names in the index.')
+@click.option('--typed', default=200, help='Names typed out one keystroke at a time.')
+@click.option('--changes', default=1000, help='Renames applied after the load.')
+@click.option('--seed', default=0)
+def bench(names, typed, changes, seed):
+  """Prints load time, memory and p50/p99/max latency per keystroke and per change."""
+  rng = random.Random(seed)
+  rows = list(synthetic_names(names, rng))
+
+  index = PrefixIndex()
+  start = time.perf_counter()
+  index.load(rows)
+  print("loaded %d names in %.2fs" % (names, time.perf_counter() - start))
+  stats = index.stats()
+  print("%d keys, %.1f MB (%.1f bytes per name)" % (
+    stats['keys'], stats['total_bytes'] / 1e6, stats['total_bytes'] / names))
+
+  keystrokes = []
+  for kind, item_id, name in rng.sample(rows, min(typed, names)):
+    for end in range(1, len(name) + 1):
+      start = time.perf_counter()
+      index.search(name[:end], 10)
+      keystrokes.append((time.perf_counter() - start) * 1000)
+
+  updates = []
+  for kind, item_id, name in rng.sample(rows, min(changes, names)):
+    start = time.perf_counter()
+    index.add(kind, item_id, name + ' remix', name)
+    updates.append((time.perf_counter() - start) * 1000)
+
+  print("\n%-10s %8s %10s %10s %10s" % ('', 'count', 'p50 ms', 'p99 ms', 'max ms'))
+  for label, timings in (('keystroke', keystrokes), ('rename', updates)):
+    print("%-10s %8d %10.3f %10.3f %10.3f" % (
+      label, len(timings), percentile(timings, 50), percentile(timings, 99), max(timings)))
+
+
+if __name__ == "__main__":
+  bench()
@@ -0,0 +1,68 @@
+"""
+Builds the "listeners also played" neighbour table (collaborative.py) from synthetic
+listens and reports build time, memory, incremental rebuild time and serving latency.
+
+No database is needed: listens are generated in memory with a Zipf skew, so a few
+songs are very popular and most are rarely played, like real listening data.
+
+    python3 benchmarks/bench_collaborative.py --listens 1000000 --users 50000 --songs 100000
+"""
+import os
+import resource
+import sys
+import time
+
+import click
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from collaborative import SongNeighbours
+
+
+def percentile(samples, pct):
+  samples = sorted(samples)
+  index = min(len(samples) - 1, int(round(pct / 100 * (len(samples) - 1))))
+  return samples[index]
+
+
+def synthetic_listens(rng, listens, users, songs):
+  user_rows = rng.integers(0, users, size=listens)
+  song_rows = (rng.zipf(1.2, size=listens) - 1) % songs
+  return [('user%d' % u, 'song%d' % s) for u, s in zip(user_rows, song_rows)]
+
+
+@click.command()
+@click.option('--listens', default=1000000, help='listensTO rows to generate.')
+@click.option('--users', default=50000, help='Distinct users.')
+@click.option('--songs', default=100000, help='Distinct songs.')
+@click.option('--k', default=20, help='Neighbours kept per song.')
+@click.option('--new-listens', default=1000, help='Listens added before the incremental rebuild.')
+@click.option('--seed', default=4111, help='Random seed.')
+def bench(listens, users, songs, k, new_listens, seed):
+  """Prints build time, memory, incremental rebuild time and recommend() latency."""
+  rng = np.random.default_rng(seed)
+  rows = synthetic_listens(rng, listens, users, songs)
+
+  neighbours = SongNeighbours(k=k)
+  neighbours.rebuild(rows)
+  stats = neighbours.stats()
+  print("full build:        %d listens, %d users, %d songs in %.2fs" % (
+    stats['listens'], stats['users'], stats['songs'], stats['build_seconds']))
+  print("arrays in memory:  %.1f MB" % (stats['array_bytes'] / 2**20))
+  print("peak RSS:          %.1f MB" % (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+  rows += synthetic_listens(rng, new_listens, users, songs)
+  neighbours.rebuild(rows)
+  print("incremental build: +%d listens, %d songs recomputed in %.2fs" % (
+    new_listens, neighbours.rebuilt_songs, neighbours.build_seconds))
+
+  timings = []
+  for u in rng.integers(0, users, size=1000):
+    start = time.perf_counter()
+    neighbours.recommend('user%d' % u, 20)
+    timings.append((time.perf_counter() - start) * 1000)
+  print("recommend():       p50 %.3f ms, p99 %.3f ms" % (percentile(timings, 50), percentile(timings, 99)))
+
+
+if __name__ == "__main__":
+  bench()
@@ -0,0 +1,154 @@
+"""
+Small in-process caches used by server.py.
+
+Everything here lives in the memory of one server process, so each process
+has its own copy. Entries expire after a TTL, the cache never grows past
+`maxsize` entries (the least recently used one is dropped first), and it
+keeps hit/miss counters so /cache_stats can show whether it is helping.
+
+get_or_compute() is single-flight: when many requests miss on the same key at
+once (e.g. a hot page just expired), one of them computes the value and the
+rest wait for it instead of all running the same queries.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+_missing = object()
+
+
+class _Flight:
+  """One get_or_compute() call in progress, which other callers for the same key wait on."""
+
+  def __init__(self):
+    self.done = threading.Event()
+    self.value = _missing
+
+
+class TTLCache:
+  """
+  A thread-safe dictionary with a time-to-live and an LRU size limit.
+
+      cache = TTLCache(maxsize=1000, ttl=300)
+      page = cache.get_or_compute(('songs', user_id), lambda: build_page(user_id))
+      album = cache.get_or_compute(('album', album_id), lambda: load_album(album_id), negative_ttl=10)
+  """
+
+  def __init__(self, maxsize=1024, ttl=300):
+    self.maxsize = maxsize
+    self.ttl = ttl
+    self._entries = OrderedDict()  # key -> (expires_at, value), oldest first
+    self._lock = threading.Lock()
+    self._flights = {}  # key -> _Flight for the values being computed right now
+    self._generation = 0  # bumped by every invalidation, see get_or_compute()
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self.invalidations = 0
+    self.coalesced = 0  # misses that waited for another caller's computation
+
+  def _lookup(self, key):
+    """The live value for key or _missing. Call with the lock held."""
+    entry = self._entries.get(key, _missing)
+    if entry is not _missing:
+      expires_at, value = entry
+      if expires_at > time.monotonic():
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+      del self._entries[key]
+    self.misses += 1
+    return _missing
+
+  def get(self, key, default=None):
+    with self._lock:
+      value = self._lookup(key)
+      return default if value is _missing else value
+
+  def set(self, key, value, ttl=None):
+    with self._lock:
+      self._store(key, value, ttl)
+
+  def _store(self, key, value, ttl):
+    """Call with the lock held."""
+    self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+    self._entries.move_to_end(key)
+    while len(self._entries) > self.maxsize:
+      self._entries.popitem(last=False)
+      self.evictions += 1
+
+  def get_or_compute(self, key, compute, negative_ttl=None):
+    """
+    Returns the cached value for key, calling compute() and caching its result on a miss.
+
+    Only one caller computes a missing key at a time; the others wait and get its
+    result. If it raises, they each try compute() themselves. A None result is
+    cached for negative_ttl seconds instead of the TTL when negative_ttl is given
+    (e.g. "not found"), or not cached at all when it is 0.
+
+    A value whose computation overlapped an invalidation is returned but not
+    cached, since it may have been read before the change.
+    """
+    with self._lock:
+      value = self._lookup(key)
+      if value is not _missing:
+        return value
+      flight = self._flights.get(key)
+      leader = flight is None
+      if leader:
+        flight = self._flights[key] = _Flight()
+        generation = self._generation
+      else:
+        self.coalesced += 1
+
+    if not leader:
+      flight.done.wait()
+      return flight.value if flight.value is not _missing else compute()
+
+    try:
+      value = compute()
+      ttl = negative_ttl if value is None else None
+      with self._lock:
+        if self._generation == generation and ttl != 0:
+          self._store(key, value, ttl)
+      flight.value = value
+      return value
+    finally:
+      with self._lock:
+        del self._flights[key]
+      flight.done.set()
+
+  def invalidate(self, key):
+    with self._lock:
+      self._generation += 1
+      if self._entries.pop(key, _missing) is not _missing:
+        self.invalidations += 1
+
+  def invalidate_where(self, predicate):
+    """Drops every entry whose key matches predicate(key)."""
+    with self._lock:
+      self._generation += 1
+      for key in [k for k in self._entries if predicate(k)]:
+        del self._entries[key]
+        self.invalidations += 1
+
+  def clear(self):
+    with self._lock:
+      self._generation += 1
+      self.invalidations += len(self._entries)
+      self._entries.clear()
+
+  def stats(self):
+    with self._lock:
+      lookups = self.hits + self.misses
+      return {
+        'size': len(self._entries),
+        'maxsize': self.maxsize,
+        'ttl': self.ttl,
+        'hits': self.hits,
+        'misses': self.misses,
+        'hit_rate': self.hits / lookups if lookups else 0.0,
+        'evictions': self.evictions,
+        'invalidations': self.invalidations,
+        'coalesced': self.coalesced,
+      }
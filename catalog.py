@@ -0,0 +1,393 @@
+"""
+In-memory copy of the catalog for serving the album, artist, genre and song pages
+without the database (CATALOG_SNAPSHOT=1 in server.py).
+
+Rows aren't kept as Python objects. Each table is sorted by ID and an item is just
+its position in that order (its interned ID). Text columns are packed into one
+string per column plus an array of offsets, text columns with few distinct values
+(a song's genre) into an array of small codes, and numbers into the smallest typed
+array that fits. Links between tables (an album's songs, a genre's artists, ...) are
+CSR pairs of int arrays: targets[offsets[i]:offsets[i + 1]] are item i's links,
+already in the order the page lists them.
+
+A snapshot never changes once it is built; server.py builds a new one and swaps it in.
+"""
+import sys
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+
+# Text columns where at most this fraction of the values are distinct are stored as codes
+CODE_FRACTION = 0.1
+
+
+def _int_array(values):
+  """The values in the smallest typed array that holds them all."""
+  values = list(values)
+  low, high = min(values, default=0), max(values, default=0)
+  for typecode in ('b', 'h', 'i', 'q'):
+    limit = 2 ** (array(typecode).itemsize * 8 - 1)
+    if -limit <= low and high < limit:
+      return array(typecode, values)
+  raise OverflowError("values don't fit in 64 bits")
+
+
+def _nbytes(column):
+  if isinstance(column, list):
+    return sys.getsizeof(column) + sum(sys.getsizeof(value) for value in column)
+  return column.nbytes()
+
+
+class _Strings:
+  """A read-only list of strings (or None) stored as one string plus the offset where each one starts."""
+
+  def __init__(self, values):
+    self.nulls = frozenset(i for i, value in enumerate(values) if value is None)
+    values = ['' if value is None else value for value in values]
+    self.blob = ''.join(values)
+    self.offsets = _int_array(accumulate(map(len, values), initial=0))
+
+  def __len__(self):
+    return len(self.offsets) - 1
+
+  def __getitem__(self, i):
+    if i in self.nulls:
+      return None
+    return self.blob[self.offsets[i]:self.offsets[i + 1]]
+
+  def nbytes(self):
+    return sys.getsizeof(self.blob) + sys.getsizeof(self.offsets) + sys.getsizeof(self.nulls)
+
+
+class _Codes:
+  """A column with few distinct values: each value once, plus a small int per row pointing at it."""
+
+  def __init__(self, values):
+    self.values = list(dict.fromkeys(values))
+    code = {value: i for i, value in enumerate(self.values)}
+    self.codes = _int_array(code[value] for value in values)
+
+  def __len__(self):
+    return len(self.codes)
+
+  def __getitem__(self, i):
+    return self.values[self.codes[i]]
+
+  def nbytes(self):
+    return _nbytes(self.values) + sys.getsizeof(self.codes)
+
+
+class _Numbers:
+  """An integer or boolean column as a typed array, with the rows that are NULL kept aside."""
+
+  def __init__(self, values, kind):
+    self.kind = kind
+    self.nulls = frozenset(i for i, value in enumerate(values) if value is None)
+    self.data = _int_array(0 if value is None else int(value) for value in values)
+
+  def __len__(self):
+    return len(self.data)
+
+  def __getitem__(self, i):
+    if i in self.nulls:
+      return None
+    return self.kind(self.data[i])
+
+  def nbytes(self):
+    return sys.getsizeof(self.data) + sys.getsizeof(self.nulls)
+
+
+def _column(name, values):
+  """Stores one column in whichever of the classes above fits what's in it."""
+  present = [value for value in values if value is not None]
+  if all(isinstance(value, bool) for value in present):
+    return _Numbers(values, bool)
+  if all(isinstance(value, int) for value in present):
+    return _Numbers(values, int)
+  if all(isinstance(value, str) for value in present):
+    if name.endswith('id'):
+      values = [None if value is None else value.strip() for value in values]  # CHAR(20) keys lose their padding
+    if len(set(values)) <= CODE_FRACTION * len(values):
+      return _Codes(values)
+    return _Strings(values)
+  return list(values)  # anything else (dates, arrays) stays as Python objects
+
+
+class Row(tuple):
+  """A row as a tuple, so the templates can index it, with its column names in _mapping like a SQLAlchemy Row."""
+
+  def __new__(cls, columns, values):
+    row = super().__new__(cls, values)
+    row._mapping = dict(zip(columns, values))
+    return row
+
+
+class _Table:
+  """One table's rows sorted by their ID (the first column). An item is its position in that order."""
+
+  def __init__(self, columns, rows):
+    rows = sorted(rows, key=lambda row: row[0].strip())
+    self.columns = tuple(columns)
+    self.data = [_column(name, [row[c] for row in rows]) for c, name in enumerate(self.columns)]
+    self.ids = self.data[0]
+
+  def __len__(self):
+    return len(self.ids)
+
+  def find(self, item_id):
+    """The item with this ID, or None."""
+    item_id = item_id.strip()
+    i = bisect_left(self.ids, item_id)
+    return i if i < len(self.ids) and self.ids[i] == item_id else None
+
+  def index(self):
+    """{ID: item} for looking up many IDs at once while building. Not kept."""
+    return {self.ids[i]: i for i in range(len(self))}
+
+  def column(self, name):
+    return self.data[self.columns.index(name)]
+
+  def values(self, i):
+    return tuple(column[i] for column in self.data)
+
+  def row(self, i):
+    return Row(self.columns, self.values(i))
+
+  def sort_order(self, name):
+    """Every item, sorted the way the pages list this table: by the `name` column, then ID."""
+    names, ids = self.column(name), self.ids
+    return array('i', sorted(range(len(self)), key=lambda i: (names[i] is None, names[i] or '', ids[i])))
+
+  def nbytes(self):
+    return sum(_nbytes(column) for column in self.data)
+
+
+class _Links:
+  """
+  For every item of one table, a list of items of another (a CSR adjacency list).
+  Each list is in the order of `order`, a sequence of every target item.
+  """
+
+  def __init__(self, count, pairs, order):
+    rank = array('i', bytes(4 * len(order)))
+    for position, item in enumerate(order):
+      rank[item] = position
+    width = len(order)
+    keys = sorted(source * width + rank[target] for source, target in pairs)
+
+    lengths = array('i', bytes(4 * count))
+    for key in keys:
+      lengths[key // width] += 1
+    self.offsets = _int_array(accumulate(lengths, initial=0))
+    self.targets = _int_array(order[key % width] for key in keys)
+
+  def __getitem__(self, source):
+    return self.targets[self.offsets[source]:self.offsets[source + 1]]
+
+  def nbytes(self):
+    return sys.getsizeof(self.offsets) + sys.getsizeof(self.targets)
+
+
+class CatalogSnapshot:
+  """
+  The catalog tables, read once and kept in compact arrays.
+
+      snapshot = CatalogSnapshot({name: (column_names, rows) for name in CatalogSnapshot.TABLES})
+      page = snapshot.album_page('al1', {'songs': page_request})
+
+  The *_page() methods take the PageRequests for the page's lists (see pagination.py)
+  and return what the matching load_*_page() in server.py returns from the database.
+  """
+
+  TABLES = ('song', 'artist', 'albumbelong', 'genre', 'playlist', 'contains2', 'belongsto2', 'contains1')
+
+  def __init__(self, tables):
+    start = time.perf_counter()
+    songs = self.songs = _Table(*tables['song'])
+    artists = self.artists = _Table(*tables['artist'])
+    albums = self.albums = _Table(*tables['albumbelong'])
+    genres = self.genres = _Table(*tables['genre'])
+    playlists = self.playlists = _Table(*tables['playlist'])
+
+    # Each table in the order its lists are shown in: by title or name, then ID
+    self.song_order = songs.sort_order('title')
+    album_order = albums.sort_order('title')
+    artist_order = artists.sort_order('name')
+    playlist_order = playlists.sort_order('title')
+
+    # The link tables as (item, item) pairs. Rows pointing at a missing item are dropped, like an inner join
+    song_index, album_index = songs.index(), albums.index()
+    song_album = self._pairs(tables['contains2'], ('songid', song_index), ('albumid', album_index))
+    artist_genre = self._pairs(tables['belongsto2'], ('artistid', artists.index()), ('genreid', genres.index()))
+    song_playlist = self._pairs(tables['contains1'], ('songid', song_index), ('playlistid', playlists.index()))
+    del song_index, album_index
+
+    artist_index = artists.index()
+    album_artist_ids = albums.column('artistid')
+    self.album_artist = _int_array(artist_index.get(album_artist_ids[a], -1) for a in range(len(albums)))
+    album_artist = [(a, artist) for a, artist in enumerate(self.album_artist) if artist >= 0]
+
+    # A genre's albums are the ones whose Genre is the genre's trimmed name, as in genreAlbum
+    # (migrations/010_genre_index.sql)
+    genre_names = genres.column('name')
+    named = {}
+    for g in range(len(genres)):
+      if genre_names[g] and genre_names[g].strip():
+        named.setdefault(genre_names[g].strip(), []).append(g)
+    album_genres = albums.column('genre')
+    genre_album = [(g, a) for a in range(len(albums)) for g in named.get(album_genres[a], ())]
+
+    self.album_songs = _Links(len(albums), [(a, s) for s, a in song_album], self.song_order)
+    self.song_albums = _Links(len(songs), song_album, range(len(albums)))
+    self.song_playlists = _Links(len(songs), song_playlist, playlist_order)
+    # An artist in several genres is shown with the one with the lowest ID (the database query has no ORDER BY)
+    self.artist_genres = _Links(len(artists), artist_genre, range(len(genres)))
+    self.genre_artists = _Links(len(genres), [(g, a) for a, g in artist_genre], artist_order)
+    self.artist_albums = _Links(len(artists), [(artist, a) for a, artist in album_artist], album_order)
+    self.genre_albums = _Links(len(genres), genre_album, album_order)
+
+    # An artist's or genre's songs go through its albums, once per album like the SQL joins.
+    # Their items are (song, album) links, numbered by position in song_album and ordered
+    # by song title, song ID and then album ID, which keeps every item's key unique
+    album_ids = albums.ids
+    song_rank = array('i', bytes(4 * len(songs)))
+    for position, s in enumerate(self.song_order):
+      song_rank[s] = position
+    self.link_songs = _int_array(s for s, a in song_album)
+    self.link_albums = _int_array(a for s, a in song_album)
+    link_order = sorted(range(len(song_album)), key=lambda l: (song_rank[song_album[l][0]], album_ids[song_album[l][1]]))
+    album_links = {}
+    for l, (s, a) in enumerate(song_album):
+      album_links.setdefault(a, []).append(l)
+    self.artist_songs = _Links(len(artists), [(artist, l) for a, artist in album_artist for l in album_links.get(a, ())],
+                               link_order)
+    self.genre_songs = _Links(len(genres), [(g, l) for g, a in genre_album for l in album_links.get(a, ())],
+                              link_order)
+    del song_rank, link_order, album_links
+
+    song_titles, song_ids = songs.column('title'), songs.ids
+    album_titles = albums.column('title')
+    artist_names, artist_ids = artists.column('name'), artists.ids
+    playlist_titles, playlist_ids = playlists.column('title'), playlists.ids
+    self._song_key = lambda s: (song_titles[s], song_ids[s])
+    self._album_key = lambda a: (album_titles[a], album_ids[a])
+    self._artist_key = lambda a: (artist_names[a], artist_ids[a])
+    self._playlist_key = lambda p: (playlist_titles[p], playlist_ids[p])
+    self._link_key = lambda l: self._song_key(self.link_songs[l]) + (album_ids[self.link_albums[l]],)
+    self.build_seconds = time.perf_counter() - start
+    self.built_at = time.time()
+
+  @staticmethod
+  def _pairs(table, left, right):
+    columns, rows = table
+    (left_column, left_index), (right_column, right_index) = left, right
+    left_at, right_at = columns.index(left_column), columns.index(right_column)
+    pairs = []
+    for row in rows:
+      l, r = left_index.get(row[left_at].strip()), right_index.get(row[right_at].strip())
+      if l is not None and r is not None:
+        pairs.append((l, r))
+    return pairs
+
+  def _page(self, page_request, items, key, table):
+    return page_request.page([table.row(i) for i in page_request.slice(items, key)])
+
+  def _song_links_page(self, page_request, links):
+    """A page of (song, album) links as song rows with the album ID added, like the SQL lists."""
+    columns = self.songs.columns + ('albumid',)
+    return page_request.page([Row(columns, self.songs.values(self.link_songs[l]) + (self.albums.ids[self.link_albums[l]],))
+                              for l in page_request.slice(links, self._link_key)])
+
+  def album_page(self, album_id, lists):
+    """The album, its artist and genre, and lists['songs'] of its songs. None if it's not found."""
+    a = self.albums.find(album_id)
+    if a is None or self.album_artist[a] < 0:
+      return None
+    artist = self.album_artist[a]
+    genres = self.artist_genres[artist]
+    if not genres:
+      return None  # the database query joins through the artist's genre too
+
+    album = Row(self.albums.columns + ('artistname', 'artistid', 'genrename'),
+                self.albums.values(a) + (self.artists.column('name')[artist], self.artists.ids[artist],
+                                         self.genres.column('name')[genres[0]]))
+    songs = self._page(lists['songs'], self.album_songs[a], self._song_key, self.songs)
+    return dict(album=album, songs=songs.rows, pages={'songs': songs})
+
+  def artist_page(self, artist_id, lists):
+    """The artist and their genre, and lists['albums'] / lists['songs']. None if it's not found."""
+    artist = self.artists.find(artist_id)
+    if artist is None or not self.artist_genres[artist]:
+      return None
+    genre = self.artist_genres[artist][0]
+
+    row = Row(self.artists.columns + ('genrename', 'genreid'),
+              self.artists.values(artist) + (self.genres.column('name')[genre], self.genres.ids[genre]))
+    pages = {'albums': self._page(lists['albums'], self.artist_albums[artist], self._album_key, self.albums),
+             'songs': self._song_links_page(lists['songs'], self.artist_songs[artist])}
+    return dict(artist=row, albums=pages['albums'].rows, songs=pages['songs'].rows, pages=pages)
+
+  def genre_page(self, genre_id, lists):
+    """The genre and lists['artists'] / lists['albums'] / lists['songs']. None if it's not found."""
+    g = self.genres.find(genre_id)
+    if g is None:
+      return None
+
+    pages = {'artists': self._page(lists['artists'], self.genre_artists[g], self._artist_key, self.artists),
+             'albums': self._page(lists['albums'], self.genre_albums[g], self._album_key, self.albums),
+             'songs': self._song_links_page(lists['songs'], self.genre_songs[g])}
+    return dict(genre=self.genres.row(g), artists=pages['artists'].rows, albums=pages['albums'].rows,
+                songs=pages['songs'].rows, pages=pages)
+
+  def song_results(self, song_id, song_title, page_request):
+    """
+    The song page's list of songs: each song with this ID or title once per album,
+    with the album's artist and details, ordered by title, song ID and album ID.
+    """
+    found = set()
+    s = self.songs.find(song_id) if song_id else None
+    if s is not None:
+      found.add(s)
+    if song_title:
+      titles = self.songs.column('title')
+      order = self.song_order
+      start = bisect_left(order, (song_title,), key=lambda s: (titles[s],))
+      end = bisect_right(order, (song_title,), key=lambda s: (titles[s],))
+      found.update(order[start:end])
+
+    album_ids = self.albums.ids
+    items = sorted(((s, a) for s in found for a in self.song_albums[s] if self.album_artist[a] >= 0),
+                   key=lambda item: self._song_key(item[0]) + (album_ids[item[1]],))
+    columns = self.songs.columns + ('artistname', 'artistid', 'albumtitle', 'albumid', 'albumgenre')
+    rows = []
+    for s, a in page_request.slice(items, lambda item: self._song_key(item[0]) + (album_ids[item[1]],)):
+      artist = self.album_artist[a]
+      rows.append(Row(columns, self.songs.values(s) + (
+        self.artists.column('name')[artist], self.artists.ids[artist],
+        self.albums.column('title')[a], album_ids[a], self.albums.column('genre')[a])))
+    return page_request.page(rows)
+
+  def song_playlists_page(self, song_id, page_request):
+    """The playlists a song is on, by title."""
+    s = self.songs.find(song_id)
+    items = self.song_playlists[s] if s is not None else []
+    return self._page(page_request, items, self._playlist_key, self.playlists)
+
+  def stats(self):
+    tables = {'songs': self.songs, 'artists': self.artists, 'albums': self.albums, 'genres': self.genres,
+              'playlists': self.playlists}
+    links = (self.album_songs, self.song_albums, self.song_playlists, self.artist_genres, self.genre_artists,
+             self.artist_albums, self.genre_albums, self.artist_songs, self.genre_songs)
+    tables_bytes = sum(table.nbytes() for table in tables.values())
+    links_bytes = (sum(link.nbytes() for link in links) + sys.getsizeof(self.song_order) +
+                   sys.getsizeof(self.album_artist) + sys.getsizeof(self.link_songs) + sys.getsizeof(self.link_albums))
+    stats = {name: len(table) for name, table in tables.items()}
+    stats.update({
+      'tables_bytes': tables_bytes,
+      'links_bytes': links_bytes,
+      'total_bytes': tables_bytes + links_bytes,
+      'build_seconds': self.build_seconds,
+      'built_at': self.built_at,
+    })
+    return stats
@@ -0,0 +1,222 @@
+"""
+"Listeners also played" song recommendations (item-item collaborative filtering).
+
+listensTO is loaded into a sparse users x songs matrix (SciPy CSR, one 1 for
+every song a user listened to). Two songs are similar when the same users
+listened to both: the cosine similarity of their columns. For every song we
+keep only its top-K most similar songs, so serving a recommendation is a few
+array lookups instead of a query.
+
+NumPy and SciPy are only needed if this module is used; server.py imports it
+lazily for /recommendations/<username>?mode=cf.
+"""
+import threading
+import time
+
+import numpy as np
+import scipy.sparse as sp
+
+# How many songs to compute similarities for at once while building
+BATCH_SONGS = 4096
+
+# Once this fraction of listens has changed since the last full build, do a full build again
+FULL_REBUILD_FRACTION = 0.05
+
+
+class _Snapshot:
+  """Everything one build produced. Swapped in as a whole so readers never see half a rebuild."""
+
+  def __init__(self, user_ids, song_ids, pairs, matrix, neighbours, scores):
+    self.user_ids = user_ids            # matrix row -> userID
+    self.song_ids = song_ids            # matrix column -> songID
+    self.user_index = {u: i for i, u in enumerate(user_ids)}
+    self.pairs = pairs                  # sorted user_row << 32 | song_column, one per listen
+    self.matrix = matrix                # users x songs CSR
+    self.neighbours = neighbours        # songs x K columns of the most similar songs (-1 = none)
+    self.scores = scores                # songs x K cosine similarities matching neighbours
+
+
+class SongNeighbours:
+  """
+  The top-K neighbour table for every song, built from (userID, songID) listen rows.
+
+      neighbours = SongNeighbours(k=20)
+      neighbours.rebuild(conn.execute(text("SELECT TRIM(userID), TRIM(songID) FROM listensTO")))
+      song_ids = neighbours.recommend(user_id, 20)
+
+  Calling rebuild() again with fresh rows only recomputes the songs whose
+  co-listen counts changed since the previous build, and falls back to a full
+  build once FULL_REBUILD_FRACTION of the listens have changed.
+  """
+
+  def __init__(self, k=20):
+    self.k = k
+    self._snapshot = None
+    self._lock = threading.Lock()  # one rebuild at a time
+    self.build_seconds = None
+    self.rebuilt_songs = 0
+    self.built_at = None
+    self._changed_since_full = 0
+
+  @property
+  def ready(self):
+    return self._snapshot is not None
+
+  def rebuild(self, listens):
+    """
+    (Re)builds the neighbour table from an iterable of (userID, songID) rows.
+    Returns how many songs had their neighbours recomputed.
+    """
+    with self._lock:
+      start = time.perf_counter()
+      old = self._snapshot
+
+      # Keep the row/column numbers from the previous build so only new IDs get new ones
+      user_ids = list(old.user_ids) if old else []
+      song_ids = list(old.song_ids) if old else []
+      user_index = dict(old.user_index) if old else {}
+      song_index = {s: i for i, s in enumerate(song_ids)}
+      rows, cols = [], []
+      for user_id, song_id in listens:
+        row = user_index.get(user_id)
+        if row is None:
+          row = user_index[user_id] = len(user_ids)
+          user_ids.append(user_id)
+        col = song_index.get(song_id)
+        if col is None:
+          col = song_index[song_id] = len(song_ids)
+          song_ids.append(song_id)
+        rows.append(row)
+        cols.append(col)
+
+      rows = np.asarray(rows, dtype=np.int64)
+      cols = np.asarray(cols, dtype=np.int64)
+      pairs = np.unique((rows << 32) | cols)
+      rows, cols = (pairs >> 32).astype(np.int32), (pairs & 0xffffffff).astype(np.int32)
+      matrix = sp.csr_matrix((np.ones(len(pairs), dtype=np.float32), (rows, cols)),
+                             shape=(len(user_ids), len(song_ids)))
+
+      changed = self._changed_listens(old, pairs) if old else pairs
+      if old is not None and len(changed) == 0:
+        self.build_seconds = time.perf_counter() - start
+        self.rebuilt_songs = 0
+        return 0
+
+      self._changed_since_full += len(changed)
+      if old is None or self._changed_since_full > FULL_REBUILD_FRACTION * len(pairs):
+        dirty = np.arange(len(song_ids))
+        self._changed_since_full = 0
+      else:
+        dirty = self._dirty_songs(old, changed, matrix)
+
+      neighbours = np.full((len(song_ids), self.k), -1, dtype=np.int32)
+      scores = np.zeros((len(song_ids), self.k), dtype=np.float32)
+      if old is not None:
+        # Songs that didn't change keep the neighbours from the previous build
+        neighbours[:len(old.song_ids)] = old.neighbours
+        scores[:len(old.song_ids)] = old.scores
+      self._compute_neighbours(matrix, dirty, neighbours, scores)
+
+      self._snapshot = _Snapshot(user_ids, song_ids, pairs, matrix, neighbours, scores)
+      self.build_seconds = time.perf_counter() - start
+      self.rebuilt_songs = len(dirty)
+      self.built_at = time.time()
+      return len(dirty)
+
+  def _changed_listens(self, old, pairs):
+    return np.union1d(np.setdiff1d(pairs, old.pairs, assume_unique=True),
+                      np.setdiff1d(old.pairs, pairs, assume_unique=True))
+
+  def _dirty_songs(self, old, changed, matrix):
+    """
+    Songs whose co-listen counts changed: the songs that gained or lost a listen,
+    plus every song listened to by a user who gained or lost one (old or new data).
+
+    Other songs that share listeners with a changed song only see that song's
+    listener count move a little, so they are left alone until the next full build.
+    """
+    changed_songs = np.unique(changed & 0xffffffff)
+    changed_users = np.unique(changed >> 32)
+    dirty = [changed_songs]
+    for m in (old.matrix, matrix):
+      users = changed_users[changed_users < m.shape[0]]
+      dirty.append(m[users].indices)
+    return np.unique(np.concatenate(dirty))
+
+  def _compute_neighbours(self, matrix, songs, neighbours, scores):
+    """Fills in the top-K rows for `songs`, BATCH_SONGS songs at a time."""
+    n_songs = matrix.shape[1]
+    k = self.k
+
+    # Scale every song column to length 1 so a dot product is the cosine similarity
+    listeners = np.asarray(matrix.sum(axis=0)).ravel()
+    norms = np.zeros(n_songs, dtype=np.float32)
+    np.divide(1.0, np.sqrt(listeners), out=norms, where=listeners > 0)
+    normalized = (matrix @ sp.diags(norms)).tocsc()
+    normalized_t = normalized.T.tocsr()
+
+    for start in range(0, len(songs), BATCH_SONGS):
+      batch = songs[start:start + BATCH_SONGS]
+      sims = (normalized_t[batch] @ normalized).tocsr()
+
+      # Most songs only share listeners with a few others, so rank the non-zero
+      # similarities of each row directly instead of expanding them into a dense array
+      rows = np.repeat(np.arange(len(batch)), np.diff(sims.indptr))
+      cols, values = sims.indices, sims.data
+      keep = (cols != batch[rows]) & (values > 0)  # a song isn't its own neighbour
+      rows, cols, values = rows[keep], cols[keep], values[keep]
+
+      order = np.lexsort((-values, rows))
+      rows, cols, values = rows[order], cols[order], values[order]
+      row_starts = np.searchsorted(rows, np.arange(len(batch)))
+      rank = np.arange(len(rows)) - row_starts[rows]
+      top = rank < k
+
+      neighbours[batch] = -1
+      scores[batch] = 0
+      neighbours[batch[rows[top]], rank[top]] = cols[top]
+      scores[batch[rows[top]], rank[top]] = values[top]
+
+  def recommend(self, user_id, n=20):
+    """
+    The n songs (IDs, best first) most similar to what user_id has listened to,
+    leaving out songs they already listened to.
+    """
+    snapshot = self._snapshot
+    if snapshot is None:
+      return []
+    row = snapshot.user_index.get(user_id)
+    if row is None:
+      return []
+
+    listened = snapshot.matrix[row].indices
+    candidates = snapshot.neighbours[listened].ravel()
+    weights = snapshot.scores[listened].ravel()
+    keep = candidates >= 0
+    totals = np.bincount(candidates[keep], weights=weights[keep], minlength=len(snapshot.song_ids))
+    totals[listened] = 0
+
+    n = min(n, int(np.count_nonzero(totals)))
+    if n == 0:
+      return []
+    best = np.argpartition(-totals, n - 1)[:n]
+    best = best[np.argsort(-totals[best])]
+    return [snapshot.song_ids[i] for i in best]
+
+  def stats(self):
+    snapshot = self._snapshot
+    if snapshot is None:
+      return {'ready': False}
+    m = snapshot.matrix
+    return {
+      'ready': True,
+      'users': len(snapshot.user_ids),
+      'songs': len(snapshot.song_ids),
+      'listens': int(m.nnz),
+      'k': self.k,
+      'build_seconds': self.build_seconds,
+      'rebuilt_songs': self.rebuilt_songs,
+      'built_at': self.built_at,
+      'array_bytes': int(m.data.nbytes + m.indices.nbytes + m.indptr.nbytes + snapshot.pairs.nbytes +
+                         snapshot.neighbours.nbytes + snapshot.scores.nbytes),
+    }
@@ -0,0 +1,428 @@
+"""
+Synthetic Mock-Spotify data at any scale, loaded with COPY.
+
+    python3 server.py generate-data --scale 10 --seed 4111 --truncate
+
+Scale 1 is 10,000 users, 2,000 artists, 10,000 albums, 100,000 songs, 20,000 playlists
+and 1,000,000 listens (see BASE_ROWS), and every table grows linearly with it, so
+--scale 10 gives 10M listensTO rows. The number of genres grows with the square root.
+
+Popularity is Zipfian, the way it is on a real streaming service: item k of n (in a
+random order, so the popular ones are spread over the key range) gets weight
+1 / k**skew. It decides which songs get listened to and put on playlists, which
+artists get followed and release the most albums, which playlists get followed, which
+genres artists play, and how active each user is. The words in names and biographies
+are drawn the same way.
+
+The same seed always gives the same rows: each table has its own random.Random seeded
+from the seed and the table's name.
+
+Rows are streamed into Postgres with COPY FROM STDIN as they are generated, so memory
+stays flat however many rows are loaded. The load is one transaction with the user
+triggers on the loaded tables turned off and their foreign keys dropped, then added
+back (which checks every row at once) before it commits. The tables those triggers
+maintain (genreAlbum/genreSong, artistPlaylist, catalogSearch) are rebuilt from
+scratch before it commits too, when their migrations have been applied.
+Servers that are running keep their caches and snapshots, so restart them afterwards.
+"""
+import bisect
+import heapq
+import itertools
+import random
+import time
+from datetime import date, timedelta
+
+# Rows at scale 1
+BASE_ROWS = {
+  'users': 10000,
+  'artists': 2000,
+  'albums': 10000,
+  'songs': 100000,
+  'playlists': 20000,
+  'listens': 1000000,          # listensTO
+  'follows': 100000,           # users following artists
+  'playlist_follows': 60000,   # createORfollow rows with Creates = false
+  'playlist_songs': 500000,    # contains1
+}
+
+GENRE_NAMES = (
+  'Pop', 'Rock', 'Hip Hop', 'Electronic', 'Jazz', 'Classical', 'Country', 'R&B', 'Metal',
+  'Folk', 'Blues', 'Reggae', 'Latin', 'Punk', 'Soul', 'Indie', 'Funk', 'Ambient', 'House',
+  'Techno', 'Disco', 'Gospel', 'K-Pop', 'Afrobeat', 'Grunge', 'Ska', 'Trap', 'Lo-Fi',
+  'Bossa Nova', 'Opera',
+)
+
+WORDS = (
+  'love', 'night', 'heart', 'light', 'dream', 'fire', 'summer', 'blue', 'rain', 'road',
+  'city', 'home', 'gold', 'wild', 'star', 'moon', 'river', 'time', 'dance', 'shadow',
+  'ocean', 'echo', 'neon', 'velvet', 'storm', 'silver', 'ghost', 'paper', 'glass', 'electric',
+  'midnight', 'sun', 'winter', 'honey', 'static', 'desert', 'thunder', 'garden', 'crystal', 'highway',
+  'abstract', 'art', 'artist', 'soul', 'rhythm', 'machine', 'echoes', 'satellite', 'lonely', 'forever',
+)
+
+# Dates and years are counted back from here, so they pass the CHECK (... <= CURRENT_DATE)
+# constraints and stay the same from one day to the next
+LAST_DATE = date(2024, 12, 31)
+
+# Rows handed to COPY per read()
+COPY_BATCH = 5000
+
+_copy_escapes = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+def _text(value):
+  """value as a COPY text-format field."""
+  if value is None:
+    return '\\N'
+  return str(value).translate(_copy_escapes)
+
+
+class Zipf:
+  """
+  Draws items 0..n-1 with weight 1 / rank**skew. Ranks are a random permutation of the
+  items, so item 0 isn't always the most popular.
+  """
+
+  def __init__(self, n, skew, rng):
+    self.n = n
+    self.items = list(range(n))
+    rng.shuffle(self.items)  # rank -> item
+    weights = [1.0 / (rank + 1) ** skew for rank in range(n)]
+    self.cumulative = list(itertools.accumulate(weights))
+    self.total = self.cumulative[-1] if n else 0.0
+    self.weights = [0.0] * n  # item -> weight
+    for rank, item in enumerate(self.items):
+      self.weights[item] = weights[rank]
+
+  def draw(self, rng):
+    return self.items[min(bisect.bisect(self.cumulative, rng.random() * self.total), self.n - 1)]
+
+  def sample(self, rng, k, exclude=()):
+    """k distinct items (fewer if there aren't enough), none of them in exclude."""
+    k = min(k, self.n - len(exclude))
+    if k <= 0:
+      return []
+    if k * 3 > self.n:
+      # Most of the items are wanted, so rejection would spin on the popular ones: weighted
+      # sampling without replacement by key u**(1/w) (Efraimidis and Spirakis) instead
+      keys = ((rng.random() ** (1.0 / self.weights[item]), item) for item in range(self.n) if item not in exclude)
+      return [item for _, item in heapq.nlargest(k, keys)]
+    picked = {}  # a dict, not a set, so the order doesn't depend on hashing
+    for _ in range(k * 20):
+      item = self.draw(rng)
+      if item not in exclude:
+        picked[item] = None
+        if len(picked) == k:
+          break
+    return list(picked)
+
+
+def allocate(total, weights, cap):
+  """Splits total into whole counts proportional to weights, none of them above cap."""
+  counts = [0] * len(weights)
+  active = [i for i, weight in enumerate(weights) if weight > 0]
+  left = min(total, cap * len(active))
+  while left > 0 and active:
+    share = left / sum(weights[i] for i in active)
+    added = 0
+    for i in active:
+      add = min(cap - counts[i], int(weights[i] * share))
+      counts[i] += add
+      added += add
+    left -= added
+    if not added:
+      # Every share rounded down to nothing: one more each for the heaviest until it's spent
+      for i in sorted(active, key=lambda i: -weights[i])[:left]:
+        counts[i] += 1
+      left = 0
+    active = [i for i in active if counts[i] < cap]
+  return counts
+
+
+def _words(rng, zipf, count):
+  return ' '.join(WORDS[zipf.draw(rng)] for _ in range(count))
+
+
+def _day(rng, years=10):
+  return LAST_DATE - timedelta(days=rng.randrange(365 * years))
+
+
+class Generator:
+  """The rows of every table for one scale and seed, as COPY text lines."""
+
+  def __init__(self, scale=1.0, seed=4111, skew=1.0, prefix='', rows=None):
+    self.seed = seed
+    self.skew = skew
+    self.prefix = prefix
+    self.rows = {name: max(1, int(count * scale)) for name, count in BASE_ROWS.items()}
+    self.rows.update(rows or {})
+    self.genres = max(10, int(round(len(GENRE_NAMES) * scale ** 0.5)))
+
+    # What later tables need to know about earlier ones
+    rng = self.rng('shape')
+    self.genre_names = [self.genre_name(g) for g in range(self.genres)]
+    self.genre_zipf = Zipf(self.genres, skew, rng)
+    self.artist_zipf = Zipf(self.rows['artists'], skew, rng)
+    self.song_zipf = Zipf(self.rows['songs'], skew, rng)
+    self.playlist_zipf = Zipf(self.rows['playlists'], skew, rng)
+    self.user_zipf = Zipf(self.rows['users'], skew, rng)
+    self.word_zipf = Zipf(len(WORDS), skew, rng)
+    self.artist_genres = [self._artist_genres(rng) for _ in range(self.rows['artists'])]
+    self.album_artist = [self.artist_zipf.draw(rng) for _ in range(self.rows['albums'])]
+    self.album_genre = [rng.choice(self.artist_genres[artist]) for artist in self.album_artist]
+    self.album_year = [LAST_DATE.year - int(rng.expovariate(1 / 12)) % 60 for _ in range(self.rows['albums'])]
+
+  def rng(self, table):
+    return random.Random('%s:%s' % (self.seed, table))
+
+  def genre_name(self, g):
+    if g < len(GENRE_NAMES):
+      return GENRE_NAMES[g]
+    return '%s %d' % (GENRE_NAMES[g % len(GENRE_NAMES)], g // len(GENRE_NAMES) + 1)
+
+  def _artist_genres(self, rng):
+    genres = [self.genre_zipf.draw(rng)]
+    if rng.random() < 0.25:
+      second = self.genre_zipf.draw(rng)
+      if second != genres[0]:
+        genres.append(second)
+    return genres
+
+  def id(self, kind, i):
+    return '%s%s%d' % (self.prefix, kind, i)
+
+  def album_of(self, song):
+    """Songs are split evenly over the albums in order, so every album has some."""
+    return song * self.rows['albums'] // self.rows['songs']
+
+  # One method per table: (table, columns, lines)
+
+  def genre(self):
+    lines = ('%s\t%s\t%s\n' % (self.id('g', g), _text(name), _text('Everything %s.' % name))
+             for g, name in enumerate(self.genre_names))
+    return 'Genre', ('GenreID', 'Name', 'Description'), lines
+
+  def artist(self):
+    rng = self.rng('artist')
+    lines = ('%s\t%s\t%s\n' % (self.id('ar', a), _text(('%s %s' % (_words(rng, self.word_zipf, 2), a)).title()[:20]),
+                               _text(_words(rng, self.word_zipf, rng.randint(8, 30))))
+             for a in range(self.rows['artists']))
+    return 'Artist', ('ArtistID', 'Name', 'Biography'), lines
+
+  def belongs_to2(self):
+    lines = ('%s\t%s\n' % (self.id('ar', a), self.id('g', g))
+             for a, genres in enumerate(self.artist_genres) for g in genres)
+    return 'belongsTo2', ('ArtistID', 'GenreID'), lines
+
+  def album_belong(self):
+    rng = self.rng('albumBelong')
+    lines = ('%s\t%s\t%d\t%s\t%s\n' % (self.id('al', al), _text(_words(rng, self.word_zipf, 2).title()[:20]),
+                                       self.album_year[al], _text(self.genre_names[self.album_genre[al]]),
+                                       self.id('ar', self.album_artist[al]))
+             for al in range(self.rows['albums']))
+    return 'albumBelong', ('AlbumID', 'Title', 'ReleaseYear', 'Genre', 'ArtistID'), lines
+
+  def song(self):
+    rng = self.rng('song')
+    weights = self.song_zipf.weights
+    def lines():
+      for s in range(self.rows['songs']):
+        album = self.album_of(s)
+        yield '%s\t%s\t%s\t%d\t%d\t%s\t%d\n' % (
+          self.id('s', s), _text(_words(rng, self.word_zipf, rng.randint(1, 3)).title()[:20]),
+          _text(self.genre_names[self.album_genre[album]]), rng.randint(90, 480), self.album_year[album],
+          't' if rng.random() < 0.3 else 'f', 1 + int(1000000 * weights[s]))
+    return 'Song', ('songID', 'Title', 'Genre', 'Duration', 'ReleaseYear', 'Liked', 'AmountPlay'), lines()
+
+  def contains2(self):
+    lines = ('%s\t%s\n' % (self.id('s', s), self.id('al', self.album_of(s))) for s in range(self.rows['songs']))
+    return 'contains2', ('songID', 'AlbumID'), lines
+
+  def users(self):
+    rng = self.rng('users')
+    def lines():
+      for u in range(self.rows['users']):
+        name = self.id('user', u)
+        favorites = {self.genre_names[self.genre_zipf.draw(rng)] for _ in range(rng.randint(1, 3))}
+        yield '%s\t%s\t%s\t%s\t%s\n' % (
+          self.id('u', u), _text(name), _text('%s@example.com' % name), _text('password%04d' % (u % 10000)),
+          _text('{%s}' % ','.join('"%s"' % genre for genre in sorted(favorites))))
+    return 'Users', ('userID', 'UserName', 'Email', 'Password', 'FavoriteGenres'), lines()
+
+  def playlist(self):
+    rng = self.rng('playlist')
+    lines = ('%s\t%s\t%s\t%d\n' % (self.id('p', p), _text(_words(rng, self.word_zipf, 2).title()[:20]),
+                                   _text(_words(rng, self.word_zipf, rng.randint(0, 15))), _day(rng).year)
+             for p in range(self.rows['playlists']))
+    return 'Playlist', ('PlaylistID', 'Title', 'Description', 'CreationYear'), lines
+
+  def _per_user(self, table, total, zipf):
+    """(user, items) for every user, each with its Zipfian share of total, items drawn from zipf."""
+    rng = self.rng(table)
+    counts = allocate(total, self.user_zipf.weights, max(1, zipf.n // 2))
+    for u, count in enumerate(counts):
+      yield u, zipf.sample(rng, count), rng
+
+  def contains1(self):
+    rng = self.rng('contains1')
+    sizes = allocate(self.rows['playlist_songs'], [rng.random() + 0.2 for _ in range(self.rows['playlists'])],
+                     max(1, self.rows['songs'] // 2))
+    lines = ('%s\t%s\n' % (self.id('s', s), self.id('p', p))
+             for p, size in enumerate(sizes) for s in self.song_zipf.sample(rng, size))
+    return 'contains1', ('songID', 'PlaylistID'), lines
+
+  def create_or_follow(self):
+    def lines():
+      rng = self.rng('createORfollow:creators')
+      created = {}
+      for p in range(self.rows['playlists']):
+        created.setdefault(self.user_zipf.draw(rng), set()).add(p)
+      for u, playlists in created.items():
+        for p in sorted(playlists):
+          yield '%s\t%s\tt\t%s\n' % (self.id('u', u), self.id('p', p), _day(rng))
+      rng = self.rng('createORfollow')
+      counts = allocate(self.rows['playlist_follows'], self.user_zipf.weights, max(1, self.rows['playlists'] // 2))
+      for u, count in enumerate(counts):
+        for p in self.playlist_zipf.sample(rng, count, created.get(u, ())):
+          yield '%s\t%s\tf\t%s\n' % (self.id('u', u), self.id('p', p), _day(rng))
+    return 'createORfollow', ('userID', 'PlaylistID', 'Creates', 'AddedDate'), lines()
+
+  def follows(self):
+    lines = ('%s\t%s\t%s\n' % (self.id('u', u), self.id('ar', a), _day(rng))
+             for u, artists, rng in self._per_user('follows', self.rows['follows'], self.artist_zipf)
+             for a in artists)
+    return 'follows', ('userID', 'ArtistID', 'FollowDate'), lines
+
+  def listens_to(self):
+    lines = ('%s\t%s\n' % (self.id('s', s), self.id('u', u))
+             for u, songs, rng in self._per_user('listensTO', self.rows['listens'], self.song_zipf)
+             for s in songs)
+    return 'listensTO', ('songID', 'userID'), lines
+
+  def tables(self):
+    """Every table, parents before the tables that reference them."""
+    return [self.genre, self.artist, self.belongs_to2, self.album_belong, self.song, self.contains2,
+            self.users, self.playlist, self.contains1, self.create_or_follow, self.follows, self.listens_to]
+
+
+class _LineStream:
+  """A file for COPY FROM STDIN that generates its lines as psycopg2 reads them."""
+
+  def __init__(self, lines):
+    self.lines = iter(lines)
+    self.rows = 0
+
+  def read(self, size=-1):
+    batch = list(itertools.islice(self.lines, COPY_BATCH))
+    self.rows += len(batch)
+    return ''.join(batch)
+
+
+# Tables kept up to date by triggers, and how to rebuild them: (table or function, SQL, tables it fills)
+DERIVED = (
+  ('rebuild_genre_index()', "SELECT rebuild_genre_index()", ('genreAlbum', 'genreSong')),
+  ('artistplaylist', """
+    TRUNCATE artistPlaylist;
+    INSERT INTO artistPlaylist (ArtistID, PlaylistID, Songs)
+    SELECT albumBelong.ArtistID, contains1.PlaylistID, COUNT(*)
+    FROM contains1
+    JOIN contains2 ON contains1.songID = contains2.songID
+    JOIN albumBelong ON contains2.AlbumID = albumBelong.AlbumID
+    GROUP BY albumBelong.ArtistID, contains1.PlaylistID""", ('artistPlaylist',)),
+  ('catalogsearch', """
+    TRUNCATE catalogSearch;
+    INSERT INTO catalogSearch (Kind, ItemID, Name, Body)
+    SELECT 'artist', ArtistID, Name, Biography FROM Artist
+    UNION ALL
+    SELECT 'playlist', PlaylistID, Title, Description FROM Playlist
+    UNION ALL
+    SELECT 'genre', GenreID, Name, Description FROM Genre""", ('catalogSearch',)),
+)
+
+
+def _exists(cursor, name):
+  if name.endswith('()'):
+    cursor.execute("SELECT to_regprocedure(%s) IS NOT NULL", (name,))
+  else:
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (name,))
+  return cursor.fetchone()[0]
+
+
+def load(dbapi_conn, generator, truncate=False, report=print):
+  """
+  Loads every table of generator into the database in one transaction, calling report()
+  with a line per table. Returns {table: rows}.
+  """
+  tables = [make() for make in generator.tables()]
+  names = [table for table, _, _ in tables]
+  loaded = {}
+  rebuilt = []
+  cursor = dbapi_conn.cursor()
+  try:
+    if truncate:
+      cursor.execute("TRUNCATE %s CASCADE" % ', '.join(names))
+    else:
+      cursor.execute("SELECT EXISTS (SELECT 1 FROM Song WHERE songID = %s)", (generator.id('s', 0),))
+      if cursor.fetchone()[0]:
+        raise ValueError("the database already has song %s: use truncate or a different prefix" % generator.id('s', 0))
+
+    # Checking each row's foreign keys as it arrives costs a lookup per row; adding the
+    # constraints back after the load checks them all in one join per constraint
+    cursor.execute("""
+      SELECT conrelid::regclass::text, conname, pg_get_constraintdef(oid)
+      FROM pg_constraint
+      WHERE contype = 'f' AND conrelid = ANY(%s::regclass[])
+      ORDER BY conrelid, conname
+    """, (names,))
+    foreign_keys = cursor.fetchall()
+    for table, constraint, _ in foreign_keys:
+      cursor.execute('ALTER TABLE %s DROP CONSTRAINT "%s"' % (table, constraint))
+    for table in names:
+      cursor.execute("ALTER TABLE %s DISABLE TRIGGER USER" % table)
+
+    started = time.perf_counter()
+    for table, columns, lines in tables:
+      start = time.perf_counter()
+      stream = _LineStream(lines)
+      cursor.copy_expert("COPY %s (%s) FROM STDIN" % (table, ', '.join(columns)), stream)
+      elapsed = time.perf_counter() - start
+      loaded[table] = stream.rows
+      report("%-15s %11d rows %8.1fs %11.0f rows/s" % (table, stream.rows, elapsed, stream.rows / max(elapsed, 1e-9)))
+    total = sum(loaded.values())
+    elapsed = time.perf_counter() - started
+    report("%-15s %11d rows %8.1fs %11.0f rows/s" % ('total', total, elapsed, total / max(elapsed, 1e-9)))
+
+    start = time.perf_counter()
+    for table, constraint, definition in foreign_keys:
+      cursor.execute('ALTER TABLE %s ADD CONSTRAINT "%s" %s' % (table, constraint, definition))
+    report("checked %d foreign keys in %.1fs" % (len(foreign_keys), time.perf_counter() - start))
+
+    for name, sql, derived in DERIVED:
+      if _exists(cursor, name):
+        start = time.perf_counter()
+        cursor.execute(sql)
+        rebuilt.extend(derived)
+        report("rebuilt %s in %.1fs" % (name.rstrip('()'), time.perf_counter() - start))
+
+    for table in names:
+      cursor.execute("ALTER TABLE %s ENABLE TRIGGER USER" % table)
+    dbapi_conn.commit()
+  except Exception:
+    dbapi_conn.rollback()
+    raise
+  finally:
+    cursor.close()
+
+  # VACUUM as well as ANALYZE, and the rebuilt tables too, so the planner sees the tables
+  # as they will stay (visibility map included) rather than as autovacuum last left them.
+  # VACUUM can't run in a transaction, hence autocommit on the psycopg2 connection.
+  raw = getattr(dbapi_conn, 'driver_connection', dbapi_conn)
+  raw.autocommit = True
+  try:
+    cursor = raw.cursor()
+    for table in names + rebuilt:
+      cursor.execute("VACUUM ANALYZE %s" % table)
+    cursor.close()
+  finally:
+    raw.autocommit = False
+  return loaded
@@ -0,0 +1,195 @@
+"""
+Logging for server.py: a logger per part of the app, levels picked from the environment,
+and a background thread that does the formatting and writing.
+
+    LOG_LEVEL=INFO LOG_LEVELS=recommendations=DEBUG,requests=DEBUG python3 server.py
+
+    log = get_logger('recommendations')
+    log.debug("songs recommended for user %s: %s", user_id, songs)
+
+Every logger lives under 'mockspotify' (mockspotify.recommendations, mockspotify.requests,
+...). LOG_LEVEL sets the level for all of them and LOG_LEVELS overrides it per logger.
+
+A call below the logger's level returns after one integer comparison: the arguments are
+never formatted, so passing a list of rows to log.debug() costs nothing in production.
+A call that is logged is put on a queue and the request carries on; a thread formats the
+message and writes it to stderr. The arguments are formatted on that thread too, so
+don't log an object the caller changes afterwards. If the queue fills up (stderr is
+slower than the requests logging to it), new records are dropped and counted rather
+than making requests wait.
+
+LOG_FORMAT=json writes one JSON object per line instead of text. Extra key/values given
+as extra={'fields': {...}} are added to either format.
+
+stats() has the number of records waiting in the queue and dropped so far; server.py
+exports them in /metrics.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+
+ROOT = 'mockspotify'
+
+TEXT_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+LEVELS = {
+  'CRITICAL': logging.CRITICAL,
+  'ERROR': logging.ERROR,
+  'WARNING': logging.WARNING,
+  'INFO': logging.INFO,
+  'DEBUG': logging.DEBUG,
+  'NOTSET': logging.NOTSET,
+}
+
+FORMATS = ('text', 'json')
+
+
+def get_logger(name):
+  """The logger for one part of the app, e.g. get_logger('recommendations')."""
+  return logging.getLogger('%s.%s' % (ROOT, name))
+
+
+def parse_level(level, setting='LOG_LEVEL'):
+  """'debug' -> 10. Raises ValueError naming the setting for anything that isn't a level."""
+  try:
+    return LEVELS[level.strip().upper()]
+  except KeyError:
+    raise ValueError("unknown log level %r for %s, expected one of %s" % (
+      level, setting, ', '.join(LEVELS))) from None
+
+
+def parse_format(log_format, setting='LOG_FORMAT'):
+  """'JSON' -> 'json'. Raises ValueError naming the setting for anything but text or json."""
+  if log_format.strip().lower() not in FORMATS:
+    raise ValueError("unknown log format %r for %s, expected one of %s" % (
+      log_format, setting, ', '.join(FORMATS)))
+  return log_format.strip().lower()
+
+
+def parse_levels(spec):
+  """'recommendations=DEBUG,metrics=WARNING' -> {'mockspotify.recommendations': 10, ...}"""
+  levels = {}
+  for item in spec.split(','):
+    if not item.strip():
+      continue
+    name, _, level = item.partition('=')
+    if not level.strip():
+      raise ValueError("expected name=LEVEL, got %r" % item)
+    levels['%s.%s' % (ROOT, name.strip())] = parse_level(level, 'LOG_LEVELS %s' % name.strip())
+  return levels
+
+
+class TextFormatter(logging.Formatter):
+  def format(self, record):
+    line = super().format(record)
+    fields = getattr(record, 'fields', None)
+    if fields:
+      line += ' ' + ' '.join('%s=%s' % (key, value) for key, value in fields.items())
+    return line
+
+
+class JSONFormatter(logging.Formatter):
+  def format(self, record):
+    entry = {
+      'time': self.formatTime(record),
+      'level': record.levelname,
+      'logger': record.name,
+      'message': record.getMessage(),
+    }
+    entry.update(getattr(record, 'fields', None) or {})
+    if record.exc_info:
+      entry['exception'] = self.formatException(record.exc_info)
+    return json.dumps(entry, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+  """Puts records on the queue as they are, and drops them when the queue is full."""
+
+  def __init__(self, records):
+    super().__init__(records)
+    self.dropped = 0
+
+  def prepare(self, record):
+    return record  # formatted by the listener thread, not the caller
+
+  def enqueue(self, record):
+    try:
+      self.queue.put_nowait(record)
+    except queue.Full:
+      self.dropped += 1
+
+
+class LogQueue:
+  """The queue between the app's loggers and the thread that writes to stderr."""
+
+  def __init__(self, handler, max_records=10000):
+    self.target = handler
+    self.records = queue.Queue(max_records)
+    self.handler = _QueueHandler(self.records)
+    self.listener = logging.handlers.QueueListener(self.records, handler)
+    self.listener.start()
+
+  def stop(self):
+    """Writes whatever is still queued, then stops the thread."""
+    if self.listener._thread is not None:
+      self.listener.stop()
+
+  def stats(self):
+    return {'queued': self.records.qsize(), 'dropped': self.handler.dropped}
+
+
+_current = None
+
+
+def setup(level='INFO', levels='', log_format='text', stream=None, max_records=10000):
+  """
+  Sends every 'mockspotify.*' logger through a new LogQueue and returns it. Calling it
+  again replaces the previous setup (after writing out what it had queued).
+  """
+  global _current
+  root_level, name_levels, log_format = parse_level(level), parse_levels(levels), parse_format(log_format)
+  handler = logging.StreamHandler(stream or sys.stderr)
+  handler.setFormatter(JSONFormatter() if log_format == 'json' else TextFormatter(TEXT_FORMAT))
+
+  root = logging.getLogger(ROOT)
+  if _current is not None:
+    root.removeHandler(_current.handler)
+    _current.stop()
+  for name in logging.root.manager.loggerDict:
+    if name.startswith(ROOT + '.'):
+      logging.getLogger(name).setLevel(logging.NOTSET)
+
+  _current = LogQueue(handler, max_records)
+  root.addHandler(_current.handler)
+  root.setLevel(root_level)
+  root.propagate = False  # Flask's and werkzeug's handlers don't print ours twice
+  for name, name_level in name_levels.items():
+    logging.getLogger(name).setLevel(name_level)
+  return _current
+
+
+def stats():
+  """The current LogQueue's stats: {'queued': ..., 'dropped': ...}, zeros before setup()."""
+  return _current.stats() if _current is not None else {'queued': 0, 'dropped': 0}
+
+
+def unqueue():
+  """
+  For a forked child process: the listener thread isn't copied into it, so records put
+  on the queue would never be written. Has each logging call write its own record instead.
+  """
+  global _current
+  if _current is not None:
+    root = logging.getLogger(ROOT)
+    root.removeHandler(_current.handler)
+    root.addHandler(_current.target)
+    _current = None
+
+
+@atexit.register
+def _flush():
+  if _current is not None:
+    _current.stop()
@@ -0,0 +1,243 @@
+"""
+Per-endpoint request metrics for server.py, served at /metrics in the Prometheus text
+format (https://prometheus.io/docs/instrumenting/exposition_formats/).
+
+For every request it records, under the Flask endpoint that handled it:
+
+- total latency, time spent in the database and time spent rendering templates
+- how many SQL statements it ran and how many rows they returned
+
+as histograms, plus a request counter by status code. The SQL numbers come from
+SQLAlchemy's cursor events, so every query is counted without touching the routes.
+
+It also watches for N+1 query patterns: when one request runs the same statement more
+than n_plus_one_threshold times (a query inside a loop over rows), the request is
+counted in n_plus_one_requests_total and reported through on_n_plus_one().
+
+    metrics = Metrics(prefix='mockspotify', n_plus_one_threshold=10)
+    metrics.install(engine)
+    metrics.start_request()                           # before_request
+    metrics.finish_request('album_details', 'GET', 200)  # after_request
+    metrics.render(queries.stats(), logs.stats())     # the /metrics page
+
+The numbers live in this process only; each worker process has its own.
+"""
+import re
+import threading
+import time
+from collections import Counter as _Tally
+
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+ROW_BUCKETS = (0, 1, 10, 50, 100, 500, 1000, 5000, 10000, 100000)
+
+# Literals and whitespace that don't change which statement it is
+_literals = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_whitespace = re.compile(r'\s+')
+
+
+def fingerprint(statement, name=None):
+  """What makes two statements "the same query" for the N+1 detector: the registry name, else the normalized SQL."""
+  if name:
+    return name
+  return _whitespace.sub(' ', _literals.sub('?', statement)).strip()[:200]
+
+
+def _labels(names, values):
+  if not names:
+    return ''
+  escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in values)
+  return '{%s}' % ','.join('%s="%s"' % pair for pair in zip(names, escaped))
+
+
+def _number(value):
+  if value == float('inf'):
+    return '+Inf'
+  return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Counter:
+  def __init__(self, name, help, labels):
+    self.name, self.help, self.labels = name, help, labels
+    self.series = {}  # label values -> total
+
+  def inc(self, values, amount=1):
+    self.series[values] = self.series.get(values, 0) + amount
+
+  def render(self, lines):
+    lines.append('# HELP %s %s' % (self.name, self.help))
+    lines.append('# TYPE %s counter' % self.name)
+    for values, total in sorted(self.series.items()):
+      lines.append('%s%s %s' % (self.name, _labels(self.labels, values), _number(total)))
+
+
+class _Histogram:
+  def __init__(self, name, help, labels, buckets):
+    self.name, self.help, self.labels = name, help, labels
+    self.buckets = tuple(buckets) + (float('inf'),)
+    self.series = {}  # label values -> [count per bucket..., sum, count]
+
+  def observe(self, values, value):
+    series = self.series.get(values)
+    if series is None:
+      series = self.series[values] = [0] * len(self.buckets) + [0.0, 0]
+    for i, bound in enumerate(self.buckets):
+      if value <= bound:
+        series[i] += 1
+        break
+    series[-2] += value
+    series[-1] += 1
+
+  def render(self, lines):
+    lines.append('# HELP %s %s' % (self.name, self.help))
+    lines.append('# TYPE %s histogram' % self.name)
+    for values, series in sorted(self.series.items()):
+      cumulative = 0
+      for bound, count in zip(self.buckets, series):
+        cumulative += count
+        labels = _labels(self.labels + ('le',), values + (_number(bound),))
+        lines.append('%s_bucket%s %d' % (self.name, labels, cumulative))
+      lines.append('%s_sum%s %s' % (self.name, _labels(self.labels, values), _number(series[-2])))
+      lines.append('%s_count%s %d' % (self.name, _labels(self.labels, values), series[-1]))
+
+
+class _Request:
+  """What one request has done so far."""
+
+  def __init__(self):
+    self.started = time.perf_counter()
+    self.queries = 0
+    self.rows = 0
+    self.db_seconds = 0.0
+    self.render_seconds = 0.0
+    self.render_started = None
+    self.statements = _Tally()
+
+
+class Metrics:
+  """The counters and histograms, and the hooks that fill them in."""
+
+  def __init__(self, prefix='app', n_plus_one_threshold=10, on_n_plus_one=None):
+    self.n_plus_one_threshold = n_plus_one_threshold
+    self.on_n_plus_one = on_n_plus_one  # called with (endpoint, fingerprint, count)
+    self._local = threading.local()
+    self._lock = threading.Lock()
+
+    endpoint = ('endpoint',)
+    self.requests = _Counter(prefix + '_requests_total', 'Requests handled.', ('endpoint', 'method', 'status'))
+    self.latency = _Histogram(prefix + '_request_duration_seconds', 'Time to handle a request.',
+                              endpoint, LATENCY_BUCKETS)
+    self.db_time = _Histogram(prefix + '_request_db_seconds', 'Time a request spent running SQL.',
+                              endpoint, LATENCY_BUCKETS)
+    self.render_time = _Histogram(prefix + '_request_render_seconds', 'Time a request spent rendering templates.',
+                                  endpoint, LATENCY_BUCKETS)
+    self.query_count = _Histogram(prefix + '_request_queries', 'SQL statements run by a request.',
+                                  endpoint, QUERY_BUCKETS)
+    self.row_count = _Histogram(prefix + '_request_rows', 'Rows returned by the SQL a request ran.',
+                                endpoint, ROW_BUCKETS)
+    self.n_plus_one = _Counter(prefix + '_n_plus_one_requests_total',
+                               'Requests that ran one statement more than the N+1 threshold allows.', endpoint)
+    self._metrics = (self.requests, self.latency, self.db_time, self.render_time, self.query_count,
+                     self.row_count, self.n_plus_one)
+    self.prefix = prefix
+
+  def install(self, engine):
+    event.listen(engine, 'before_cursor_execute', self._before_execute)
+    event.listen(engine, 'after_cursor_execute', self._after_execute)
+
+  @property
+  def _current(self):
+    return getattr(self._local, 'request', None)
+
+  def start_request(self):
+    self._local.request = _Request()
+
+  def finish_request(self, endpoint, method, status):
+    """Records the request that just finished. Does nothing if it was already recorded."""
+    current = self._current
+    if current is None:
+      return
+    self._local.request = None
+    endpoint = endpoint or '(none)'
+    elapsed = time.perf_counter() - current.started
+
+    repeated = [(statement, count) for statement, count in current.statements.most_common(3)
+                if count > self.n_plus_one_threshold]
+    with self._lock:
+      key = (endpoint,)
+      self.requests.inc((endpoint, method, str(status)))
+      self.latency.observe(key, elapsed)
+      self.db_time.observe(key, current.db_seconds)
+      self.render_time.observe(key, current.render_seconds)
+      self.query_count.observe(key, current.queries)
+      self.row_count.observe(key, current.rows)
+      if repeated:
+        self.n_plus_one.inc(key)
+    if self.on_n_plus_one:
+      for statement, count in repeated:
+        self.on_n_plus_one(endpoint, statement, count)
+
+  def render_started(self, *args, **kwargs):
+    """For Flask's before_render_template signal."""
+    current = self._current
+    if current is not None:
+      current.render_started = time.perf_counter()
+
+  def render_finished(self, *args, **kwargs):
+    """For Flask's template_rendered signal."""
+    current = self._current
+    if current is not None and current.render_started is not None:
+      current.render_seconds += time.perf_counter() - current.render_started
+      current.render_started = None
+
+  def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+    current = self._current
+    if current is not None and context is not None:
+      context._metrics_started = time.perf_counter()
+
+  def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+    current = self._current
+    started = getattr(context, '_metrics_started', None)
+    if current is None or started is None:
+      return
+    current.db_seconds += time.perf_counter() - started
+    current.queries += 1
+    if cursor.rowcount > 0:
+      current.rows += cursor.rowcount
+    current.statements[fingerprint(statement, context.execution_options.get('query_name'))] += 1
+
+  def render(self, queries=None, logs=None):
+    """
+    Everything in the Prometheus text format. queries is QueryRegistry.stats() (see
+    queries.py), which adds the per-query totals, and logs is logs.stats(), which adds
+    the log queue's length and dropped records.
+    """
+    lines = []
+    with self._lock:
+      for metric in self._metrics:
+        metric.render(lines)
+
+    if queries is not None:
+      for suffix, help, field, scale in (
+          ('query_calls_total', 'Times each named query ran.', 'calls', 1),
+          ('query_seconds_total', 'Time spent in each named query.', 'total_ms', 0.001),
+          ('query_rows_total', 'Rows returned by each named query.', 'rows', 1),
+          ('query_errors_total', 'Times each named query failed.', 'errors', 1)):
+        name = '%s_%s' % (self.prefix, suffix)
+        lines.append('# HELP %s %s' % (name, help))
+        lines.append('# TYPE %s counter' % name)
+        for query in queries['queries']:
+          value = query[field] * scale
+          lines.append('%s%s %s' % (name, _labels(('query',), (query['name'],)), _number(value)))
+
+    if logs is not None:
+      for suffix, help, kind, field in (
+          ('log_queue_records', 'Log records waiting to be written.', 'gauge', 'queued'),
+          ('log_records_dropped_total', 'Log records dropped because the queue was full.', 'counter', 'dropped')):
+        name = '%s_%s' % (self.prefix, suffix)
+        lines.append('# HELP %s %s' % (name, help))
+        lines.append('# TYPE %s %s' % (name, kind))
+        lines.append('%s %s' % (name, _number(logs[field])))
+    return '\n'.join(lines) + '\n'
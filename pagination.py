@@ -0,0 +1,169 @@
+"""
+Keyset ("cursor") pagination for the lists in server.py.
+
+Each list is ordered by a key that is unique per row (e.g. a song's title and
+then its songID). A page is the next `per_page` rows after (or before) the key
+of the last row the user saw, so a query never skips rows with OFFSET and a
+page stays put when rows are added in front of it:
+
+    SELECT * FROM (<the list's query>) AS songs_rows
+    WHERE (title COLLATE "C", songid COLLATE "C") > (:songs_k0, :songs_k1)
+    ORDER BY title COLLATE "C", songid COLLATE "C"
+    LIMIT :songs_limit
+
+The key of a page's first and last rows goes into the links as an opaque
+?songs_before= / ?songs_after= cursor.
+
+Text keys are compared with COLLATE "C", in code point order, which is how Python
+compares strs. A page picked out of a list kept in memory (PageRequest.slice(), e.g.
+the catalog snapshot) then has the same rows as one read from the database, whatever
+the database's collation is, so a cursor from either one works with the other.
+"""
+import base64
+import binascii
+import json
+from bisect import bisect_left, bisect_right
+
+PAGE_SIZE = 50       # rows per page when ?per_page= isn't given
+MAX_PAGE_SIZE = 200  # most rows per page anyone can ask for
+
+
+def encode_cursor(values):
+  return base64.urlsafe_b64encode(json.dumps(list(values), separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+  """The key values in a cursor. Raises ValueError if it wasn't made by encode_cursor()."""
+  try:
+    values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+  except (binascii.Error, UnicodeDecodeError):
+    raise ValueError("bad cursor")
+  if not isinstance(values, list) or any(isinstance(value, (list, dict)) for value in values):
+    raise ValueError("bad cursor")
+  return values
+
+
+def collated(column):
+  """An order_by column as it is sorted and compared in SQL. '-' expressions are numeric."""
+  return column if column.startswith('-') else '%s COLLATE "C"' % column
+
+
+def page_size(args):
+  """?per_page= capped to 1..MAX_PAGE_SIZE, or PAGE_SIZE."""
+  try:
+    per_page = int(args.get('per_page', PAGE_SIZE))
+  except (TypeError, ValueError):
+    per_page = PAGE_SIZE
+  return max(1, min(per_page, MAX_PAGE_SIZE))
+
+
+class Page:
+  """One page of a list: its rows and the cursors for the pages around it (None at either end)."""
+
+  def __init__(self, rows, next_cursor=None, prev_cursor=None):
+    self.rows = rows
+    self.next_cursor = next_cursor
+    self.prev_cursor = prev_cursor
+
+
+class KeysetList:
+  """
+  A list shown on a page, paginated by its sort key.
+
+      songs = KeysetList('songs', "SELECT Song.* FROM Song JOIN ... WHERE ...",
+                         order_by=('title', 'songid'), key=lambda song: (song[1], song[0]))
+      request = songs.request(flask.request.args)
+      page = request.page(conn.execute(text(request.sql), {**request.params, ...}).fetchall())
+
+  order_by names output columns of `query` (or expressions on them, e.g. '-score')
+  that are unique together, and key(row) returns the same values from a fetched row.
+  Columns are text, compared with COLLATE "C"; a numeric key is written as a '-'
+  expression.
+  """
+
+  def __init__(self, name, query, order_by, key):
+    self.name = name
+    self.query = query
+    self.order_by = order_by
+    self.key = key
+
+  def request(self, args):
+    """
+    Which page of this list args (e.g. request.args) asks for. Raises ValueError
+    for a cursor that doesn't belong to this list.
+    """
+    for direction in ('after', 'before'):
+      cursor = args.get('%s_%s' % (self.name, direction))
+      if cursor:
+        values = decode_cursor(cursor)
+        if len(values) != len(self.order_by):
+          raise ValueError("bad cursor")
+        return PageRequest(self, direction, values, page_size(args))
+    return PageRequest(self, None, None, page_size(args))
+
+  @property
+  def all_sql(self):
+    """Every row of the list in order, for the pages that stream a whole list instead of one page."""
+    return 'SELECT * FROM (%s) AS %s_rows ORDER BY %s' % (
+      self.query, self.name, ', '.join(collated(column) for column in self.order_by))
+
+
+class PageRequest:
+  """The SQL for one page of a KeysetList, and how to turn the rows it returns into a Page."""
+
+  def __init__(self, keyset, direction, values, per_page):
+    self.keyset = keyset
+    self.direction = direction  # None (first page), 'after' or 'before'
+    self.values = tuple(values) if values else None
+    self.per_page = per_page
+
+    name = keyset.name
+    order_by = [collated(column) for column in keyset.order_by]
+    self.order = ', '.join('%s DESC' % column if direction == 'before' else column for column in order_by)
+    where = ''
+    self.params = {'%s_limit' % name: per_page + 1}  # one extra row says whether there is another page
+    if direction:
+      placeholders = ', '.join(':%s_k%d' % (name, i) for i in range(len(values)))
+      where = 'WHERE (%s) %s (%s)' % (', '.join(order_by), '>' if direction == 'after' else '<', placeholders)
+      self.params.update(('%s_k%d' % (name, i), value) for i, value in enumerate(values))
+    self.sql = 'SELECT * FROM (%s) AS %s_rows %s ORDER BY %s LIMIT :%s_limit' % (
+      keyset.query, name, where, self.order, name)
+
+  @property
+  def key(self):
+    """What picks this page out of the list, e.g. for caching it: direction, cursor and page size."""
+    return (self.direction, self.values, self.per_page)
+
+  @property
+  def json_sql(self):
+    """The page as one json_agg() value, for the loaders that fetch a whole page in one statement."""
+    return '(SELECT json_agg(r ORDER BY %s) FROM (%s) r)' % (self.order, self.sql)
+
+  def slice(self, items, key):
+    """
+    The same items self.sql would return, picked out of an in-memory sequence that is
+    already in the list's order: up to per_page + 1 of them, last first for 'before'.
+    key(item) returns the item's order_by values.
+    """
+    if self.direction == 'after':
+      start = bisect_right(items, self.values, key=key)
+      return items[start:start + self.per_page + 1]
+    if self.direction == 'before':
+      end = bisect_left(items, self.values, key=key)
+      return items[max(0, end - self.per_page - 1):end][::-1]
+    return items[:self.per_page + 1]
+
+  def page(self, rows):
+    rows = list(rows)
+    more = len(rows) > self.per_page
+    rows = rows[:self.per_page]
+    if self.direction == 'before':
+      rows.reverse()
+    if not rows:
+      return Page(rows)
+
+    first, last = encode_cursor(self.keyset.key(rows[0])), encode_cursor(self.keyset.key(rows[-1]))
+    if self.direction == 'before':
+      # We came back from a later page, so there is always a next one
+      return Page(rows, next_cursor=last, prev_cursor=first if more else None)
+    return Page(rows, next_cursor=last if more else None, prev_cursor=first if self.direction == 'after' else None)
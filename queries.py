@@ -0,0 +1,209 @@
+"""
+Every SQL statement server.py runs, declared by name, with per-query counters.
+
+    queries = QueryRegistry()
+    queries.install(engine)
+
+    album_query = queries.text('album', "SELECT * FROM albumBelong WHERE AlbumID = :album_id")
+    conn.execute(album_query, {'album_id': album_id})
+
+queries.text() returns an ordinary text() clause tagged with the query's name. Once the
+registry is installed on the engine, every statement with a name is:
+
+- PREPAREd on each connection the first time that connection runs it, and sent as
+  EXECUTE name(...) after that, so Postgres parses and plans it once per connection
+  instead of on every request;
+- timed and counted under its name (calls, total/average/max time, rows), see stats().
+
+Statements built at request time (a keyset page, the single-statement page loaders) go
+through queries.text() too. Each distinct SQL string becomes its own prepared statement
+and the counters add them up under the name they were given. Statements without a name
+still run, unprepared, and are counted as UNNAMED.
+
+A statement Postgres can't prepare (e.g. a parameter whose type it can't work out, or an
+IN :tuple list) just runs unprepared. The PREPARE happens inside a savepoint so a failure
+doesn't abort the caller's transaction.
+"""
+import re
+import threading
+import time
+
+from psycopg2 import Error as DBAPIError
+from sqlalchemy import event
+from sqlalchemy import text as sql_text
+
+UNNAMED = '(unnamed)'
+
+# The %(name)s placeholders that SQLAlchemy hands psycopg2
+_placeholder = re.compile(r'%\((\w+)\)s')
+
+# The statements PREPARE accepts
+_preparable = re.compile(r'\s*(SELECT|WITH|VALUES|INSERT|UPDATE|DELETE)\b', re.IGNORECASE)
+
+
+class _Prepared:
+  """How one statement is prepared: its name on the server, the PREPARE and the EXECUTE to send instead."""
+
+  def __init__(self, name, statement):
+    params = list(dict.fromkeys(_placeholder.findall(statement)))
+    positions = {param: i + 1 for i, param in enumerate(params)}
+    body = _placeholder.sub(lambda m: '$%d' % positions[m.group(1)], statement).replace('%%', '%')
+    self.name = name
+    self.prepare = 'PREPARE %s AS %s' % (name, body)
+    if params:
+      self.execute = 'EXECUTE %s(%s)' % (name, ', '.join('%%(%s)s' % param for param in params))
+    else:
+      self.execute = 'EXECUTE %s' % name
+
+
+class _Counter:
+  __slots__ = ('calls', 'total', 'max', 'rows', 'errors')
+
+  def __init__(self):
+    self.calls = self.rows = self.errors = 0
+    self.total = self.max = 0.0
+
+
+class QueryRegistry:
+  """
+  The named queries, which of them are prepared, and how long they take.
+  prepare=False keeps the counters but sends every statement as it is.
+  """
+
+  def __init__(self, prepare=True, max_prepared=500):
+    self.prepare = prepare
+    self.max_prepared = max_prepared  # prepared statements per connection, after which new ones run unprepared
+    self._lock = threading.Lock()
+    self._clauses = {}     # (name, sql, prepare) -> text() clause
+    self._statements = {}  # DBAPI statement -> _Prepared, or None when it can't be prepared
+    self._counters = {}    # query name -> _Counter
+    self.prepare_failures = 0
+
+  def text(self, name, sql, prepare=True):
+    """
+    A text() clause for sql, counted under name. The same clause object comes back for
+    the same name and SQL, so building one per request costs a dictionary lookup.
+    """
+    key = (name, sql, prepare)
+    clause = self._clauses.get(key)
+    if clause is None:
+      clause = sql_text(sql).execution_options(query_name=name, prepare_query=prepare)
+      with self._lock:
+        clause = self._clauses.setdefault(key, clause)
+    return clause
+
+  def declared(self):
+    """The names of every query built with text() so far."""
+    with self._lock:
+      return sorted({name for name, _, _ in self._clauses})
+
+  def install(self, engine):
+    event.listen(engine, 'before_cursor_execute', self._before_execute, retval=True)
+    event.listen(engine, 'after_cursor_execute', self._after_execute)
+    event.listen(engine, 'handle_error', self._failed)
+
+  def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+    if context is None:
+      return statement, parameters
+    context._query_started = time.perf_counter()
+
+    options = context.execution_options
+    if (not self.prepare or executemany or not options.get('prepare_query', True) or
+        options.get('query_name') is None or getattr(cursor, 'name', None) or
+        not isinstance(parameters, dict)):
+      return statement, parameters  # named (server-side) cursors can't DECLARE ... FOR EXECUTE
+
+    prepared = self._prepared(conn, cursor, statement)
+    if prepared is None:
+      return statement, parameters
+    return prepared.execute, parameters
+
+  def _prepared(self, conn, cursor, statement):
+    """The statement's _Prepared once it's prepared on this connection, or None to run it as it is."""
+    prepared = self._statements.get(statement, False)
+    if prepared is False:
+      with self._lock:
+        prepared = self._statements.get(statement, False)
+        if prepared is False:
+          prepared = _Prepared('q%d' % len(self._statements), statement) if _preparable.match(statement) else None
+          self._statements[statement] = prepared
+    if prepared is None:
+      return None
+
+    done = conn.connection.info.setdefault('prepared_queries', set())
+    if prepared.name in done:
+      return prepared
+    if len(done) >= self.max_prepared:
+      return None
+
+    dbapi_conn = cursor.connection
+    savepoint = not dbapi_conn.autocommit
+    try:
+      if savepoint:
+        cursor.execute("SAVEPOINT prepare_query")
+      cursor.execute(prepared.prepare)
+      if savepoint:
+        cursor.execute("RELEASE SAVEPOINT prepare_query")
+    except DBAPIError:
+      if savepoint:
+        try:
+          cursor.execute("ROLLBACK TO SAVEPOINT prepare_query")
+          cursor.execute("RELEASE SAVEPOINT prepare_query")
+        except DBAPIError:
+          pass  # the transaction was already aborted; the statement itself will say so
+      with self._lock:
+        self._statements[statement] = None
+        self.prepare_failures += 1
+      return None
+    done.add(prepared.name)
+    return prepared
+
+  def _record(self, context, rows, failed=False):
+    started = getattr(context, '_query_started', None)
+    if started is None:
+      return
+    elapsed = time.perf_counter() - started
+    context._query_started = None
+    name = context.execution_options.get('query_name') or UNNAMED
+    with self._lock:
+      counter = self._counters.get(name)
+      if counter is None:
+        counter = self._counters[name] = _Counter()
+      counter.calls += 1
+      counter.total += elapsed
+      counter.max = max(counter.max, elapsed)
+      if failed:
+        counter.errors += 1
+      elif rows > 0:
+        counter.rows += rows
+
+  def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+      self._record(context, cursor.rowcount)
+
+  def _failed(self, exception_context):
+    if exception_context.execution_context is not None:
+      self._record(exception_context.execution_context, 0, failed=True)
+
+  def stats(self):
+    """Every query's counters, the ones that took the most time in total first."""
+    with self._lock:
+      counters = sorted(self._counters.items(), key=lambda item: -item[1].total)
+      return {
+        'prepare': self.prepare,
+        'statements': len(self._statements),
+        'prepare_failures': self.prepare_failures,
+        'queries': [{
+          'name': name,
+          'calls': counter.calls,
+          'total_ms': round(counter.total * 1000, 3),
+          'avg_ms': round(counter.total * 1000 / counter.calls, 3),
+          'max_ms': round(counter.max * 1000, 3),
+          'rows': counter.rows,
+          'errors': counter.errors,
+        } for name, counter in counters],
+      }
+
+  def reset(self):
+    with self._lock:
+      self._counters.clear()